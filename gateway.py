@@ -3,157 +3,208 @@ Gateway: TCP server that broadcasts price ticks and news sentiment.
 Messages are framed with MESSAGE_DELIMITER (b'*').
 Each message is a simple CSV-like string: "<SYMBOL>,<PRICE>*" or "NEWS,<SENTIMENT>*"
 Example stream: b"AAPL,172.53*MSFT,325.20*NEWS,42*AAPL,172.61*..."
+
+The server runs on a single asyncio event loop: one StreamWriter per client.
+Each tick is handed to every client's transport without waiting on any of them,
+so a client that stops reading cannot stall the others; once its unsent backlog
+passes CLIENT_BACKLOG_BYTES it is dropped. uvloop is used when installed.
 """
 
+import asyncio
 import socket
-import threading
 import time
 import random
 import argparse
+import logging
 import csv
-from typing import Dict, List
+from typing import Dict, Set, Tuple
+import numpy as np
+
+try:
+    import uvloop
+except ImportError:  # optional: fall back to the default asyncio loop
+    uvloop = None
 
 HOST = "0.0.0.0"
 PORT = 9999
 MESSAGE_DELIMITER = b'*'
 BROADCAST_INTERVAL = 1.0  # seconds between ticks
 NEWS_INTERVAL = 5.0       # seconds between news events
+SNAPSHOT_EVERY = 10       # ticks between full snapshots; other ticks only carry changed prices
+SNDBUF_BYTES = 1 << 20    # per-client kernel send buffer
+CLIENT_BACKLOG_BYTES = 1 << 22  # unsent bytes buffered for one client before it is dropped
+SHUTDOWN_TIMEOUT = 2.0    # seconds to let client handlers finish on shutdown
 
 class GatewayServer:
     def __init__(self, host=HOST, port=PORT, symbols=None, initial_prices=None):
         self.host = host
         self.port = port
-        self.server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        # allow quick restart
-        self.server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server = None  # asyncio.Server, created in start()
 
-        self.client_sockets: List[socket.socket] = []
-        self.clients_lock = threading.Lock()
+        self.writers: Set[asyncio.StreamWriter] = set()
+        # immutable copy of self.writers, rebuilt only when a client joins or leaves,
+        # so broadcasting never has to copy the set
+        self._writers_snapshot: Tuple[asyncio.StreamWriter, ...] = ()
+        self._client_tasks: Set[asyncio.Task] = set()
         self.running = False
 
         self.symbols = symbols or ["AAPL", "MSFT", "GOOG", "AMZN"]
-        # dict: symbol -> price (float)
+        self.n = len(self.symbols)
+        self._rng = np.random.default_rng()
+        # float64 array parallel to self.symbols: prices_arr[i] is the price of symbols[i]
         if initial_prices:
-            self.prices: Dict[str, float] = {s: float(initial_prices.get(s, 100.0)) for s in self.symbols}
+            self.prices_arr = np.array([float(initial_prices.get(s, 100.0)) for s in self.symbols], dtype=np.float64)
         else:
             # random initial prices
-            self.prices = {s: round(random.uniform(50, 500), 2) for s in self.symbols}
+            self.prices_arr = np.round(self._rng.uniform(50, 500, size=self.n), 2)
 
-    def start(self):
-        self.server_sock.bind((self.host, self.port))
-        self.server_sock.listen()
-        print(f"[Gateway] Listening on {self.host}:{self.port}")
-        self.running = True
-
-        accept_thread = threading.Thread(target=self._accept_loop, daemon=True)
-        accept_thread.start()
+        # pre-encoded "SYMBOL," prefixes and a reusable frame buffer for the broadcast hot path
+        self._prefix: Dict[str, bytes] = {s: (s + ",").encode('utf-8') for s in self.symbols}
+        self._suffix = MESSAGE_DELIMITER
+        self._tx = bytearray()
+        # prices as of the last frame sent, to skip symbols whose rounded price did not move
+        self._last_sent = np.full(self.n, np.nan)
 
+    def start(self):
+        if uvloop is not None:
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
         try:
-            self._broadcast_loop()
+            asyncio.run(self._serve())
         except KeyboardInterrupt:
             print("\n[Gateway] Shutting down (KeyboardInterrupt)...")
-        finally:
-            self.stop()
 
     def stop(self):
+        # the broadcast loop notices on its next tick and closes everything down
         self.running = False
-        with self.clients_lock:
-            for c in self.client_sockets:
-                try:
-                    c.shutdown(socket.SHUT_RDWR)
-                except Exception:
-                    pass
-                try:
-                    c.close()
-                except Exception:
-                    pass
-            self.client_sockets.clear()
+
+    async def _serve(self):
+        # reuse_address allows quick restart
+        self.server = await asyncio.start_server(self._on_client, self.host, self.port,
+                                                 reuse_address=True)
+        print(f"[Gateway] Listening on {self.host}:{self.port}")
+        self.running = True
+        try:
+            await self._broadcast_loop()
+        finally:
+            self.running = False
+            for w in self._writers_snapshot:
+                self._remove_client(w, announce=False)
+            # let the client handlers see the connection go and return, rather than leaving
+            # asyncio.run to cancel them mid-read; cancel any that still have not
+            if self._client_tasks:
+                _, pending = await asyncio.wait(self._client_tasks, timeout=SHUTDOWN_TIMEOUT)
+                for task in pending:
+                    task.cancel()
+            self.server.close()
+            await self.server.wait_closed()
+            print("[Gateway] Stopped.")
+
+    async def _on_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        addr = writer.get_extra_info('peername')
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            # frames are already coalesced per tick: push each one out immediately (no Nagle)
+            # and give slow readers room in the kernel before drain() has to wait
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SNDBUF_BYTES)
+        task = asyncio.current_task()
+        self._client_tasks.add(task)
+        self.writers.add(writer)
+        self._writers_snapshot = tuple(self.writers)
+        print(f"[Gateway] Client connected: {addr}")
+        # ticks only carry changed prices, so start every new client off with a full snapshot
+        buf = bytearray()
+        self._append_prices(buf, range(self.n))
+        writer.write(bytes(buf))
         try:
-            self.server_sock.close()
-        except Exception:
+            # clients never send anything; reading only detects the disconnect
+            while await reader.read(4096):
+                pass
+        except (ConnectionError, OSError):
             pass
-        print("[Gateway] Stopped.")
+        finally:
+            self._remove_client(writer)
+            self._client_tasks.discard(task)
 
-    def _accept_loop(self):
-        while self.running:
-            try:
-                client_sock, addr = self.server_sock.accept()
-                client_sock.setblocking(True)
-                with self.clients_lock:
-                    self.client_sockets.append(client_sock)
-                print(f"[Gateway] Client connected: {addr}")
-            except Exception as e:
-                if self.running:
-                    print(f"[Gateway] Accept error: {e}")
-                break
-
-    def _broadcast_loop(self):
+    def _remove_client(self, writer: asyncio.StreamWriter, announce=True):
+        if writer not in self.writers:
+            return
+        self.writers.discard(writer)
+        self._writers_snapshot = tuple(self.writers)
+        if announce:
+            peer = writer.get_extra_info('peername') or "<unknown>"
+            print(f"[Gateway] Removing disconnected client {peer}")
+        # abort rather than close: close() waits to flush, which never happens for a
+        # client that has stopped reading
+        writer.transport.abort()
+
+    def _append_prices(self, buf: bytearray, indices):
+        # only the price itself is formatted, the "SYMBOL," prefix and delimiter are pre-encoded
+        prices = self.prices_arr.tolist()
+        for i in indices:
+            sym = self.symbols[i]
+            buf += self._prefix[sym]
+            buf += format(prices[i], ".2f").encode('ascii')
+            buf += self._suffix
+
+    async def _broadcast_loop(self):
         last_news_time = time.time()
+        tick = 0
         while self.running:
             t0 = time.time()
 
-            # update prices with a simple random-walk model
-            for sym in self.symbols:
-                # relative change: small Gaussian
-                change_pct = random.gauss(0, 0.0015)  # stdev ~0.15% per tick by default
-                new_price = self.prices[sym] * (1 + change_pct)
-                # keep to 2 decimals
-                new_price = round(max(new_price, 0.01), 2)
-                self.prices[sym] = new_price
-
-            # send price messages (one message per symbol, delimited)
-            with self.clients_lock:
-                if self.client_sockets:
-                    # create payload bytes for all symbols (each symbol ends with delimiter)
-                    payload_parts = []
-                    for sym, price in self.prices.items():
-                        payload_parts.append(f"{sym},{price}".encode('utf-8') + MESSAGE_DELIMITER)
-                    # broadcast each part
-                    for part in payload_parts:
-                        self._broadcast(part)
+            # update prices with a simple random-walk model, all symbols in one vectorized step
+            # relative change: small Gaussian, stdev ~0.15% per tick by default
+            prices = self.prices_arr
+            prices *= 1.0 + self._rng.normal(0.0, 0.0015, size=self.n)
+            # floor at 0.01 and keep to 2 decimals
+            np.maximum(prices, 0.01, out=prices)
+            np.round(prices, 2, out=prices)
+
+            # coalesce the price messages of this tick into a single frame
+            # (one write per client per tick instead of one per symbol).
+            # Unchanged prices are skipped except on the periodic full snapshot.
+            tick += 1
+            if tick % SNAPSHOT_EVERY == 0:
+                changed = range(self.n)
+            else:
+                changed = np.flatnonzero(prices != self._last_sent).tolist()
+            self._last_sent[:] = prices
+            buf = self._tx
+            del buf[:]
+            self._append_prices(buf, changed)
 
             # send news occasionally (NEWS,<sentiment>*). Use NEWS_INTERVAL.
+            # The news message rides in the same frame as the prices.
             now = time.time()
             if now - last_news_time >= NEWS_INTERVAL:
                 sentiment = random.randint(0, 100)
-                news_msg = f"NEWS,{sentiment}".encode('utf-8') + MESSAGE_DELIMITER
-                self._broadcast(news_msg)
+                buf += f"NEWS,{sentiment}".encode('utf-8') + MESSAGE_DELIMITER
                 last_news_time = now
                 # optionally jitter the next news interval
                 # NEWS_INTERVAL could be randomized if desired
 
+            if buf and self._writers_snapshot:
+                # transports may hold on to what they are given, so hand them
+                # one immutable copy of the frame rather than the reused buffer
+                self._broadcast(bytes(buf))
+
             # sleep to maintain broadcast interval, accounting for processing time
             elapsed = time.time() - t0
             to_sleep = max(0.0, BROADCAST_INTERVAL - elapsed)
-            time.sleep(to_sleep)
+            await asyncio.sleep(to_sleep)
 
     def _broadcast(self, msg: bytes):
-        # attempts to send msg to all clients; remove clients that are closed/broken
-        dead = []
-        for c in list(self.client_sockets):
-            try:
-                c.sendall(msg)
-            except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError) as e:
-                # client disconnected
-                dead.append(c)
-            except Exception as e:
-                # unexpected socket error: mark dead to cleanup
-                print(f"[Gateway] Send error: {e}")
-                dead.append(c)
-        if dead:
-            with self.clients_lock:
-                for d in dead:
-                    try:
-                        peer = d.getpeername()
-                    except Exception:
-                        peer = "<unknown>"
-                    print(f"[Gateway] Removing disconnected client {peer}")
-                    try:
-                        d.close()
-                    except Exception:
-                        pass
-                    if d in self.client_sockets:
-                        self.client_sockets.remove(d)
+        # write() never blocks: the transport sends what the kernel takes and buffers the rest,
+        # so nothing here waits on a slow client. Clients too far behind are dropped instead.
+        for w in self._writers_snapshot:
+            if w.is_closing():
+                self._remove_client(w)
+            elif w.transport.get_write_buffer_size() > CLIENT_BACKLOG_BYTES:
+                print(f"[Gateway] Dropping slow client {w.get_extra_info('peername')}")
+                self._remove_client(w, announce=False)
+            else:
+                w.write(msg)
 
 def load_prices_from_csv(csv_path: str) -> Dict[str, float]:
     prices = {}
@@ -181,10 +232,13 @@ def parse_args():
     p.add_argument("--symbols", default=None, help="Comma-separated symbol list (overrides CSV)")
     p.add_argument("--interval", default=None, type=float, help="Broadcast interval in seconds")
     p.add_argument("--news-interval", default=None, type=float, help="News interval in seconds")
+    p.add_argument("--log-level", default="WARNING", help="Logging level")
     return p.parse_args()
 
-if __name__ == "__main__":
+def main():
+    global BROADCAST_INTERVAL, NEWS_INTERVAL
     args = parse_args()
+    logging.basicConfig(level=args.log_level.upper(), format="%(message)s")
     if args.interval:
         BROADCAST_INTERVAL = args.interval
     if args.news_interval:
@@ -207,26 +261,5 @@ if __name__ == "__main__":
     gw = GatewayServer(host=args.host, port=args.port, symbols=symbols, initial_prices=initial_prices)
     gw.start()
 
-def main():
-    args = parse_args()
-    if args.interval:
-        BROADCAST_INTERVAL = args.interval
-    if args.news_interval:
-        NEWS_INTERVAL = args.news_interval
-
-    initial_prices = None
-    symbols = None
-    if args.csv:
-        try:
-            initial_prices = load_prices_from_csv(args.csv)
-            symbols = list(initial_prices.keys())
-            print(f"[Gateway] Loaded {len(symbols)} symbols from CSV.")
-        except Exception as e:
-            print(f"[Gateway] Failed to load CSV {args.csv}: {e}")
-            raise
-
-    if args.symbols:
-        symbols = [s.strip().upper() for s in args.symbols.split(',') if s.strip()]
-
-    gw = GatewayServer(host=args.host, port=args.port, symbols=symbols, initial_prices=initial_prices)
-    gw.start()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
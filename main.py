@@ -12,16 +12,21 @@
 #
 # Example (not recommended for debugging):
 #
+# Processes are started with 'spawn' (no forked copies of open sockets or NumPy state), and
+# in dependency order: Strategy attaches to the shared memory OrderBook creates, so it is only
+# started once OrderBook has signalled that the segment and market_meta.json exist.
+import multiprocessing
 from multiprocessing import Process
-import time
+
+ORDERBOOK_READY_TIMEOUT = 10.0  # seconds
 
 def run_gateway():
     import gateway
     gateway.main()
 
-def run_orderbook():
+def run_orderbook(ready):
     import orderbook
-    orderbook.main()
+    orderbook.main(ready=ready)
 
 def run_strategy():
     import strategy
@@ -31,17 +36,29 @@ def run_ordermanager():
     import order_manager
     order_manager.main()
 
-if __name__ == "__main__":
+def main():
+    multiprocessing.set_start_method('spawn', force=True)
+    orderbook_ready = multiprocessing.Event()
 
     processes = [
         Process(target=run_gateway),
 
-        Process(target=run_orderbook),
+        Process(target=run_ordermanager),
 
-        Process(target=run_strategy),
-
-        Process(target=run_ordermanager)]
+        Process(target=run_orderbook, args=(orderbook_ready,))]
 
     for p in processes: p.start()
 
+    if not orderbook_ready.wait(ORDERBOOK_READY_TIMEOUT):
+        print("[main] OrderBook did not create shared memory in time; stopping.")
+        for p in processes: p.terminate()
+        return
+
+    strategy_proc = Process(target=run_strategy)
+    strategy_proc.start()
+    processes.append(strategy_proc)
+
     for p in processes: p.join()
+
+if __name__ == "__main__":
+    main()
@@ -1,87 +1,192 @@
+import itertools
+import logging
+import selectors
 import socket
-import json
+import struct
 import threading
+import time
+from shared_memory_utils import OrderRing
 
-MESSAGE_DELIMITER = b'*'
+# Orders are fixed-size little-endian binary records (no delimiter, known length):
+# side (u8: 0=BUY, 1=SELL), pad (u8), symbol (12 bytes, NUL padded), price (f64),
+# qty (u32), client order id (u64), send timestamp (f64, time.time() at the strategy).
+ORDER_FMT = '<BB12sdIQd'
+ORDER_STRUCT = struct.Struct(ORDER_FMT)
+ORDER_SIZE = ORDER_STRUCT.size
+SIDES = ("BUY", "SELL")
+_UNPACK = ORDER_STRUCT.unpack_from
+RCVBUF_BYTES = 1 << 20  # kernel receive buffer, inherited by accepted connections
+log = logging.getLogger(__name__)
+
+CONN_BUFFER_SIZE = 4096  # per-connection receive buffer; always holds at least one record
+
+# Co-located strategies can skip TCP and write records into a shared-memory ring instead;
+# one ring per OrderManager port, one producer per ring (others keep using TCP).
+ORDER_RING_SLOTS = 1 << 16  # records (ORDER_SIZE bytes each)
+ORDER_RING_WAIT = 1.0       # seconds; consumer re-checks the ring at least this often
+LOCAL_HOSTS = ("127.0.0.1", "localhost", "::1")
+
+
+def order_ring_name(port):
+    return f"order_ring_{port}"
+
+
+class _Connection:
+    """Per-connection state for the selector loop: socket, peer and receive buffer."""
+    def __init__(self, sock, addr):
+        self.sock = sock
+        self.addr = addr
+        self.buf = bytearray(CONN_BUFFER_SIZE)
+        self.mv = memoryview(self.buf)
+        self.w = 0  # fill mark: bytes [0, w) are received but not yet processed
 
 
 class OrderManager:
-    def __init__(self, host="127.0.0.1", port=10000):
+    def __init__(self, host="127.0.0.1", port=10000, workers=1, ring=True):
         self.host = host
         self.port = port
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.order_id = 0
-        self.lock = threading.Lock()
+        self.ring = None
+        self._use_ring = ring
+        # one listening socket per accept worker; with SO_REUSEPORT the kernel
+        # load-balances incoming connections across them instead of all workers
+        # contending on a single accept queue. Opt-in: the workers are threads sharing
+        # the GIL, and SO_REUSEPORT would also let a second OrderManager share the port
+        if not hasattr(socket, "SO_REUSEPORT"):
+            workers = 1
+        self.workers = max(1, workers or 1)
+        self.server_sockets = []
+        # next() on itertools.count is atomic under the GIL, so no lock is needed
+        self._oid = itertools.count(1)
 
     def start(self):
-        self.server_socket.bind((self.host, self.port))
-        self.server_socket.listen()
-        print(f"[OrderManager] Listening on {self.host}:{self.port}")
+        if self.workers > 1:
+            # a plain bind still fails with EADDRINUSE if anything already listens here,
+            # which the SO_REUSEPORT binds below would not
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+                probe.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                probe.bind((self.host, self.port))
+        for _ in range(self.workers):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RCVBUF_BYTES)
+            if self.workers > 1:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind((self.host, self.port))
+            sock.listen()
+            self.server_sockets.append(sock)
+        print(f"[OrderManager] Listening on {self.host}:{self.port} ({self.workers} accept workers)")
 
+        if self._use_ring:
+            try:
+                self.ring = OrderRing(order_ring_name(self.port), ORDER_SIZE, ORDER_RING_SLOTS, create=True)
+            except RuntimeError as e:
+                print(f"[OrderManager] No order ring ({e}); orders over TCP only")
+            else:
+                threading.Thread(target=self._serve_ring, daemon=True).start()
+                print(f"[OrderManager] Order ring '{self.ring.name}' ready for local strategies")
+
+        # each accept worker runs its own selector loop (epoll on Linux) over its listening
+        # socket and every connection it accepted: no thread per connection
+        for sock in self.server_sockets[1:]:
+            threading.Thread(target=self._serve_worker, args=(sock,), daemon=True).start()
+        self._serve_worker(self.server_sockets[0])
+
+    def close(self):
+        if self.ring is not None:
+            self.ring.close(unlink=True)
+            self.ring = None
+        for sock in self.server_sockets:
+            sock.close()
+
+    def _serve_ring(self):
+        ring = self.ring
         while True:
-            conn, addr = self.server_socket.accept()
-            print(f"[OrderManager] Connected to Strategy at {addr}")
-            threading.Thread(target=self.handle_client, args=(conn, addr), daemon=True).start()
+            # records are processed in place in shared memory, then their slots freed
+            if not ring.drain(self.process_order):
+                ring.wait(ORDER_RING_WAIT)
 
-    def handle_client(self, conn, addr):
-        buffer = b""
+    def _serve_worker(self, lsock):
+        sel = selectors.DefaultSelector()
+        lsock.setblocking(False)
+        sel.register(lsock, selectors.EVENT_READ, None)
+        while True:
+            for key, _ in sel.select():
+                if key.data is None:
+                    self._accept(sel, key.fileobj)
+                else:
+                    self._read(sel, key.data)
+
+    def _accept(self, sel, lsock):
         try:
-            while True:
-                data = conn.recv(1024)
-                if not data:
-                    break
-                buffer += data
-                while MESSAGE_DELIMITER in buffer:
-                    raw_msg, buffer = buffer.split(MESSAGE_DELIMITER, 1)
-                    if not raw_msg:
-                        continue
-                    self.process_order(raw_msg.decode('utf-8'))
-        except (ConnectionResetError, ConnectionAbortedError):
-            print(f"[OrderManager] Client {addr} disconnected.")
-        finally:
-            conn.close()
-
-    def process_order(self, msg):
+            conn, addr = lsock.accept()
+        except BlockingIOError:
+            return
+        except OSError as e:
+            # e.g. EMFILE: this accept failed, the listener and its connections carry on
+            log.warning("[OrderManager] Accept failed: %s", e)
+            return
+        conn.setblocking(False)
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        print(f"[OrderManager] Connected to Strategy at {addr}")
+        sel.register(conn, selectors.EVENT_READ, _Connection(conn, addr))
+
+    def _read(self, sel, c):
         try:
-            order = json.loads(msg)
-            with self.lock:
-                self.order_id += 1
-                oid = self.order_id
+            nbytes = c.sock.recv_into(c.mv[c.w:])
+        except BlockingIOError:
+            return
+        except OSError as e:
+            # any socket error ends this connection only, never the worker's selector loop
+            print(f"[OrderManager] Client {c.addr} disconnected ({e}).")
+            nbytes = 0
+        if not nbytes:
+            sel.unregister(c.sock)
+            c.sock.close()
+            return
+        c.w += nbytes
+        # process every complete record, keep the partial tail for the next recv
+        end = c.w - c.w % ORDER_SIZE
+        for offset in range(0, end, ORDER_SIZE):
+            self.process_order(c.buf, offset)
+        rem = c.w - end
+        if end and rem:
+            c.mv[:rem] = c.mv[end:c.w]
+        c.w = rem
 
-            side = order.get("side")
-            # Strategy sends 'size' key; older code expected 'qty'. Accept either.
-            qty = order.get("qty") if order.get("qty") is not None else order.get("size")
-            symbol = order.get("symbol")
-            price = order.get("price")
+    def process_order(self, msg, offset=0):
+        try:
+            side, _, sym, price, qty, cid, sent_at = _UNPACK(msg, offset)
+            oid = next(self._oid)
 
             # defensive formatting
-            side_str = side.upper() if side else "UNKNOWN"
-            try:
-                price_val = float(price) if price is not None else 0.0
-            except Exception:
-                price_val = 0.0
+            side_str = SIDES[side] if side < len(SIDES) else "UNKNOWN"
+            symbol = sym.rstrip(b'\x00').decode('utf-8', 'replace')
 
-            print(f"Received Order {oid}: {side_str} {qty} {symbol} @ {price_val:.2f}")
+            # %-style args: nothing is formatted unless DEBUG is enabled
+            log.debug("Received Order %d: %s %s %s @ %.2f (%.3f ms after send)",
+                      oid, side_str, qty, symbol, price, (time.time() - sent_at) * 1000.0)
         except Exception as e:
-            print(f"[OrderManager] Failed to process order: {e}")
-
-
-if __name__ == "__main__":
-    import argparse
-    p = argparse.ArgumentParser(description="OrderManager TCP server")
-    p.add_argument("--host", default="127.0.0.1", help="Host to bind")
-    p.add_argument("--port", type=int, default=10000, help="Port to bind (default: 10000)")
-    args = p.parse_args()
+            log.warning("[OrderManager] Failed to process order: %s", e)
 
-    om = OrderManager(host=args.host, port=args.port)
-    om.start()
 
 def main():
     import argparse
     p = argparse.ArgumentParser(description="OrderManager TCP server")
     p.add_argument("--host", default="127.0.0.1", help="Host to bind")
     p.add_argument("--port", type=int, default=10000, help="Port to bind (default: 10000)")
+    p.add_argument("--workers", type=int, default=1, help="Accept workers; more than 1 uses SO_REUSEPORT (default: 1)")
+    p.add_argument("--log-level", default="WARNING", help="Logging level; DEBUG shows every order")
+    p.add_argument("--no-ring", action="store_true", help="Accept orders over TCP only (no shared-memory ring)")
     args = p.parse_args()
+    logging.basicConfig(level=args.log_level.upper(), format="%(message)s")
+
+    om = OrderManager(host=args.host, port=args.port, workers=args.workers, ring=not args.no_ring)
+    try:
+        om.start()
+    except KeyboardInterrupt:
+        print("\n[OrderManager] exiting (KeyboardInterrupt)")
+    finally:
+        om.close()
 
-    om = OrderManager(host=args.host, port=args.port)
-    om.start()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,15 @@
 """
 OrderBook:
 - Connects to Gateway (TCP) to receive messages framed by MESSAGE_DELIMITER (b'*').
-- Maintains latest prices for a list of symbols in multiprocessing.shared_memory as a NumPy structured array.
-- Writes a small metadata file market_meta.json so other processes can attach to the same shared memory.
-- Uses a file lock (market.lock) for atomic updates across independent processes.
+- Maintains latest prices for a list of symbols in multiprocessing.shared_memory as a plain float64 array.
+- Writes a small metadata file market_meta.json so other processes can attach to the same shared memory;
+  the symbol list in it gives the slot order of the price array.
+- OrderBook is the only writer of the price slots, so updates are stored straight into a
+  persistent view of the shared array (symbol -> slot index cached) without a file lock.
+  Each store is bracketed by a seqlock counter in the segment header so readers can detect
+  and retry a torn read without any syscalls.
+- After each received batch of updates the tick word in the header is bumped and waiters
+  woken (futex on Linux), so readers block until new prices exist instead of polling.
 - Reconnects to gateway if connection breaks.
 """
 
@@ -11,66 +17,63 @@ import socket
 import time
 import argparse
 import json
+import logging
 import os
 import sys
-import fcntl
 from multiprocessing import shared_memory
-import numpy as np
+from shared_memory_utils import PRICE_DTYPE, SHM_HEADER_BYTES, shm_size, price_view, seq_view, seqlock_write, TickSignal, close_shm
+
+log = logging.getLogger(__name__)
 
 HOST = "127.0.0.1"
 GATEWAY_PORT = 9999
 MESSAGE_DELIMITER = b'*'
+NEWS_PREFIX = b'NEWS,'
 META_FILE = "market_meta.json"
-LOCK_FILE = "market.lock"
 SHM_NAME_DEFAULT = "market_shm_v1"
-
-def file_lock(fd):
-    """Context manager for exclusive flock on a file descriptor."""
-    class _LockCtx:
-        def __init__(self, fd):
-            self.fd = fd
-        def __enter__(self):
-            fcntl.flock(self.fd, fcntl.LOCK_EX)
-            return self
-        def __exit__(self, exc_type, exc, tb):
-            fcntl.flock(self.fd, fcntl.LOCK_UN)
-    return _LockCtx(fd)
+RX_BUFFER_SIZE = 1 << 16  # bytes; receive buffer reused for the lifetime of the OrderBook
+RCVBUF_BYTES = 1 << 20    # kernel receive buffer for the gateway connection
 
 class OrderBook:
-    def __init__(self, gateway_host, gateway_port, symbols, shm_name=SHM_NAME_DEFAULT, lock_path=LOCK_FILE):
+    def __init__(self, gateway_host, gateway_port, symbols, shm_name=SHM_NAME_DEFAULT):
         self.gateway_host = gateway_host
         self.gateway_port = gateway_port
         self.symbols = [s.upper() for s in symbols]
         self.n = len(self.symbols)
         self.shm_name = shm_name
-        self.lock_path = lock_path
-
-        # dtype: fixed symbol bytes (S12) and float64 price
-        self.dtype = np.dtype([('symbol', 'S12'), ('price', 'f8')])
 
-        # create lock file if not exists
-        open(self.lock_path, 'a').close()
-        self.lock_fd = open(self.lock_path, 'r+')
+        # dtype: one float64 price per slot
+        self.dtype = PRICE_DTYPE
 
         # create or attach shared memory
         self._create_or_attach_shm()
 
+        # persistent views over the seqlock counter and the prices, plus a symbol -> slot index
+        # keyed on encoded symbols so the parser never decodes
+        # (self.symbols is the slot order, re-read from the meta file when attaching)
+        self._seq = seq_view(self.shm.buf)
+        self._prices = price_view(self.shm.buf, self.n)
+        self._ticks = TickSignal(self.shm.buf)
+        self._idx = {s.encode('utf-8'): i for i, s in enumerate(self.symbols)}
+
+        # preallocated receive buffer: recv_into writes at self._w, parsing reads up to it
+        self._rx = bytearray(RX_BUFFER_SIZE)
+        self._rx_mv = memoryview(self._rx)
+        self._w = 0
+
     def _create_or_attach_shm(self):
-        recsize = self.dtype.itemsize
-        total_bytes = recsize * self.n
+        total_bytes = shm_size(self.n)
         try:
             # try create new shared memory
             self.shm = shared_memory.SharedMemory(name=self.shm_name, create=True, size=total_bytes)
             print(f"[OrderBook] Created new shared memory '{self.shm_name}', size={total_bytes}")
-            buf = np.ndarray((self.n,), dtype=self.dtype, buffer=self.shm.buf)
-            # initialize
-            for i, s in enumerate(self.symbols):
-                buf['symbol'][i] = s.encode('utf-8')[:12]
-                buf['price'][i] = 0.0
+            # initialize (header and prices)
+            self.shm.buf[:total_bytes] = bytes(total_bytes)
             # write metadata
             meta = {
                 "shm_name": self.shm_name,
                 "n": self.n,
+                "header_bytes": SHM_HEADER_BYTES,
                 "dtype_descr": str(self.dtype.descr),
                 "symbols": self.symbols
             }
@@ -81,28 +84,31 @@ class OrderBook:
             # already exists: attach
             self.shm = shared_memory.SharedMemory(name=self.shm_name, create=False)
             print(f"[OrderBook] Attached to existing shared memory '{self.shm_name}'")
+            # slot order is the creator's, recorded in the meta file
+            with open(META_FILE, 'r') as f:
+                meta = json.load(f)
+            self.symbols = meta['symbols']
+            self.n = meta['n']
             # TODO: could validate size vs expected
 
     def close(self):
-        try:
-            self.shm.close()
-        except Exception:
-            pass
+        self._seq = self._prices = None
+        self._ticks.close()
+        close_shm(self.shm)
 
-    def _update_price(self, symbol: str, price: float):
-        # atomic update with file lock
-        with file_lock(self.lock_fd):
-            arr = np.ndarray((self.n,), dtype=self.dtype, buffer=self.shm.buf)
-            # find index
-            sym_b = symbol.encode('utf-8')[:12]
-            for i in range(self.n):
-                if arr['symbol'][i].tobytes().rstrip(b'\x00') == sym_b:
-                    arr['price'][i] = price
-                    # debug print
-                    # print(f"[OrderBook] Updated {symbol} -> {price}")
-                    return True
+    def _update_price(self, symbol: bytes, price: float):
+        # single writer: one float64 store under the seqlock, no file lock needed
+        i = self._idx.get(symbol)
+        if i is None:
+            # slow path for padded or lower-case symbols
+            i = self._idx.get(symbol.strip().upper())
+        if i is None:
             # if not found, ignore or add (we ignore)
             return False
+        seqlock_write(self._seq, self._prices, i, price)
+        # debug print
+        # print(f"[OrderBook] Updated {symbol} -> {price}")
+        return True
 
     def run(self):
         # connect to gateway and process messages
@@ -110,50 +116,66 @@ class OrderBook:
             try:
                 print(f"[OrderBook] Connecting to Gateway {self.gateway_host}:{self.gateway_port} ...")
                 sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                # set before connect so the larger window is negotiated
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RCVBUF_BYTES)
                 sock.connect((self.gateway_host, self.gateway_port))
                 sock.settimeout(5.0)
-                buffer = b''
+                # recv straight into self._rx plus a read cursor: consumed messages are
+                # skipped over instead of re-slicing (and copying) the tail every time
+                buffer = self._rx
+                self._w = 0
+                cursor = 0
                 print("[OrderBook] Connected. Receiving ticks...")
                 while True:
                     try:
-                        data = sock.recv(4096)
-                        if not data:
+                        nbytes = sock.recv_into(self._rx_mv[self._w:])
+                        if not nbytes:
                             raise ConnectionError("socket closed by remote")
-                        buffer += data
+                        self._w += nbytes
+                        any_updated = False
                         # parse by delimiter
                         while True:
-                            idx = buffer.find(MESSAGE_DELIMITER)
+                            idx = buffer.find(MESSAGE_DELIMITER, cursor, self._w)
                             if idx == -1:
                                 break
-                            chunk = buffer[:idx]
-                            buffer = buffer[idx+1:]
-                            if not chunk:
-                                continue
-                            try:
-                                txt = chunk.decode('utf-8')
-                            except Exception:
-                                continue
+                            start = cursor
+                            cursor = idx + 1
                             # MESSAGE formats: SYMBOL,PRICE  or NEWS,SENTIMENT
-                            parts = txt.split(',', 1)
-                            if len(parts) != 2:
-                                continue
-                            key = parts[0].strip().upper()
-                            val = parts[1].strip()
-                            if key == "NEWS":
+                            # parsed straight from the receive buffer, no decode/split/upper
+                            if buffer.startswith(NEWS_PREFIX, start, idx):
                                 # OrderBook doesn't need to handle news
                                 # but we could forward or store if desired
-                                # print(f"[OrderBook] NEWS {val}")
+                                if log.isEnabledFor(logging.DEBUG):
+                                    log.debug("[OrderBook] NEWS %s", bytes(buffer[start + len(NEWS_PREFIX):idx]))
+                                continue
+                            comma = buffer.find(b',', start, idx)
+                            if comma == -1:
                                 continue
+                            try:
+                                price = float(buffer[comma + 1:idx])
+                            except ValueError:
+                                continue
+                            key = bytes(buffer[start:comma])
+                            updated = self._update_price(key, price)
+                            if updated:
+                                any_updated = True
                             else:
-                                try:
-                                    price = float(val)
-                                except ValueError:
-                                    continue
-                                updated = self._update_price(key, price)
-                                if not updated:
-                                    # unknown symbol: optionally log
-                                    # print(f"[OrderBook] Unknown symbol {key}, ignoring")
-                                    pass
+                                # unknown symbol: optionally log
+                                log.debug("[OrderBook] Unknown symbol %s, ignoring", key)
+                        if any_updated:
+                            # one wake-up per batch, not per price
+                            self._ticks.notify()
+                        if cursor == self._w:
+                            # everything consumed (the common case): rewind for free
+                            cursor = self._w = 0
+                        elif self._w > RX_BUFFER_SIZE // 2:
+                            # running out of room: move the partial message to the front
+                            rem = self._w - cursor
+                            self._rx_mv[:rem] = self._rx_mv[cursor:self._w]
+                            cursor, self._w = 0, rem
+                            if self._w == RX_BUFFER_SIZE:
+                                # a single unterminated message filled the buffer: drop it
+                                self._w = 0
                     except socket.timeout:
                         # continue to recv
                         continue
@@ -172,12 +194,17 @@ def parse_args():
     p.add_argument("--gateway-port", type=int, default=GATEWAY_PORT)
     p.add_argument("--symbols", default="AAPL,MSFT,GOOG,AMZN")
     p.add_argument("--shm-name", default=SHM_NAME_DEFAULT)
+    p.add_argument("--log-level", default="WARNING")
     return p.parse_args()
 
-if __name__ == "__main__":
+def main(ready=None):
     args = parse_args()
+    logging.basicConfig(level=args.log_level.upper(), format="%(message)s")
     symbols = [s.strip().upper() for s in args.symbols.split(',') if s.strip()]
     ob = OrderBook(args.gateway_host, args.gateway_port, symbols, shm_name=args.shm_name)
+    if ready is not None:
+        # shared memory and market_meta.json exist now: readers may attach
+        ready.set()
     try:
         ob.run()
     except KeyboardInterrupt:
@@ -185,13 +212,5 @@ if __name__ == "__main__":
     finally:
         ob.close()
 
-def main():
-    args = parse_args()
-    symbols = [s.strip().upper() for s in args.symbols.split(',') if s.strip()]
-    ob = OrderBook(args.gateway_host, args.gateway_port, symbols, shm_name=args.shm_name)
-    try:
-        ob.run()
-    except KeyboardInterrupt:
-        print("\n[OrderBook] exiting (KeyboardInterrupt)")
-    finally:
-        ob.close()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
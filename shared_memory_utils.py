@@ -1,12 +1,295 @@
-from multiprocessing import shared_memory
+from multiprocessing import resource_tracker, shared_memory
 import numpy as np
+import ctypes
 import json
 import os
-import fcntl
+import platform
+import sys
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:  # not on Windows: no order rings there
+    fcntl = None
 
 SHM_NAME_DEFAULT = "market_shm_v1"
 META_FILE = "market_meta.json"
-LOCK_FILE = "market.lock"
+
+# Segment layout: a uint64 seqlock counter at offset 0, a uint32 tick word (futex) at
+# TICK_WORD_OFFSET on its own cache line, padded out to SHM_HEADER_BYTES so neither shares a
+# cache line with the prices, then a plain float64[n] price array. Slot i belongs to
+# meta['symbols'][i]; symbols live only in the meta file, not in shared memory.
+SHM_HEADER_BYTES = 128
+TICK_WORD_OFFSET = 64
+PRICE_DTYPE = np.dtype('f8')
+
+
+def shm_size(n):
+    return SHM_HEADER_BYTES + PRICE_DTYPE.itemsize * n
+
+
+def close_shm(shm, unlink=False):
+    """Close (and optionally unlink) a segment once its owner has set its views to None.
+
+    Every NumPy view over shm.buf is an export of it and SharedMemory.close() raises
+    BufferError while one is alive, so owners drop their views before calling this.
+    """
+    try:
+        shm.close()
+    except Exception:
+        pass
+    if unlink:
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def seq_view(buf):
+    """uint64 view of the seqlock counter at the start of the segment."""
+    return np.ndarray((1,), dtype=np.uint64, buffer=buf)
+
+
+def price_view(buf, n):
+    """float64[n] view of the price slots that follow the header."""
+    return np.ndarray((n,), dtype=PRICE_DTYPE, buffer=buf, offset=SHM_HEADER_BYTES)
+
+
+def seqlock_write(seq, prices, i, price):
+    # odd counter = write in progress, even = stable; single writer only
+    seq += 1
+    prices[i] = price
+    seq += 1
+
+
+def seqlock_read(seq, prices, i):
+    # retry until the counter is even and unchanged across the read; no syscalls
+    while True:
+        s1 = int(seq[0])
+        if s1 & 1:
+            continue
+        price = float(prices[i])
+        if int(seq[0]) == s1:
+            return price
+
+
+# futex(2) is Linux-only and has no stdlib wrapper; it is called through libc's syscall().
+# x86-64 only: the seqlock and the order ring publish with plain NumPy stores and no fences,
+# which is ordered enough only under x86's store ordering. Other machines sleep-poll instead.
+_SYS_FUTEX = 202 if sys.platform.startswith('linux') and platform.machine() == 'x86_64' else None
+_FUTEX_WAIT = 0  # shared (not FUTEX_PRIVATE_FLAG): waiter and waker are different processes
+_FUTEX_WAKE = 1
+_WAKE_ALL = 0x7fffffff
+_libc = ctypes.CDLL(None, use_errno=True) if _SYS_FUTEX is not None else None
+
+
+class _Timespec(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+
+class TickSignal:
+    """Tick word the writer bumps once per batch of price updates; readers block on it.
+
+    On Linux this is a futex: wait() sleeps in the kernel until notify() or the timeout.
+    Elsewhere wait() falls back to sleeping for the timeout.
+    """
+
+    def __init__(self, buf, offset=TICK_WORD_OFFSET):
+        self._word = np.ndarray((1,), dtype=np.uint32, buffer=buf, offset=offset)
+        self._addr = ctypes.c_void_p(self._word.ctypes.data)
+
+    def close(self):
+        self._word = None  # a view over the segment, see close_shm
+
+    def current(self):
+        return int(self._word[0])
+
+    def notify(self):
+        self._word += 1  # wraps at 2**32, waiters only compare for equality
+        if _SYS_FUTEX is not None:
+            _libc.syscall(_SYS_FUTEX, self._addr, _FUTEX_WAKE, _WAKE_ALL, None, None, 0)
+
+    def wait(self, last, timeout):
+        """Block until the tick word differs from last or timeout seconds pass; return it."""
+        if _SYS_FUTEX is None:
+            time.sleep(timeout)
+        elif int(self._word[0]) == last:
+            ts = _Timespec(int(timeout), int(timeout % 1 * 1e9))
+            # returns at once if the word already moved; spurious wake-ups are harmless
+            _libc.syscall(_SYS_FUTEX, self._addr, _FUTEX_WAIT, ctypes.c_uint32(last),
+                          ctypes.byref(ts), None, 0)
+        return int(self._word[0])
+
+
+# Order ring layout: producer index (uint64) at offset 0, the consumer's tick word at
+# TICK_WORD_OFFSET, then the consumer-written line: consumer index (uint64), a closed flag
+# (uint32) and the consumer's instance id (uint64), followed by `slots` fixed-size records.
+# Indices only ever grow; a record's slot is index & (slots - 1).
+RING_HEADER_BYTES = 192
+RING_TAIL_OFFSET = 128
+RING_CLOSED_OFFSET = 136
+RING_ID_OFFSET = 144
+RING_PROBE_INTERVAL = 1.0  # seconds; how often a producer re-checks the consumer's lock
+
+
+def _lock_file(name):
+    return os.open(os.path.join(tempfile.gettempdir(), name + ".lock"), os.O_CREAT | os.O_RDWR, 0o600)
+
+
+def attach_untracked(name):
+    """Attach to an existing segment without this process's resource tracker unlinking it at exit.
+
+    Before Python 3.13 every attach registers the segment with the resource tracker, which
+    unlinks it when the attaching process exits, taking it away from its creator.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, create=False, track=False)
+    except TypeError:  # Python < 3.13: no track argument
+        shm = shared_memory.SharedMemory(name=name, create=False)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+class OrderRing:
+    """Single-producer/single-consumer ring of fixed-size records in shared memory.
+
+    Each index is written by one side only, so no lock is taken: the producer fills a slot,
+    then publishes it by bumping the head; the consumer processes up to the head, then frees
+    the slots by moving the tail. An empty consumer blocks on the tick word (see TickSignal).
+
+    Roles are flocks on files in the temp dir, which the kernel drops when the holder exits
+    however it exits: the consumer holds <name>.lock exclusively for its lifetime, a producer
+    holds <name>.producer.lock. The consumer also stamps a random instance id into both the
+    header and its lock file, and sets the closed flag before it unlinks the ring, so a
+    producer still mapped to an old ring can tell it apart from a restarted consumer's new one.
+    """
+
+    def __init__(self, name, record_size, slots, create=False):
+        if slots & (slots - 1):
+            raise ValueError("slots must be a power of two")
+        self.name = name
+        self.record_size = record_size
+        self.slots = slots
+        self._mask = slots - 1
+        self._consumer_fd = self._producer_fd = None
+        self._is_consumer = create
+        self._probed_at = float('-inf')
+        size = RING_HEADER_BYTES + record_size * slots
+        if create:
+            if fcntl is None:
+                raise RuntimeError("order rings need fcntl.flock")
+            self._consumer_fd = _lock_file(name)
+            try:
+                fcntl.flock(self._consumer_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(self._consumer_fd)
+                raise RuntimeError(f"ring '{name}' already has a consumer") from None
+            try:
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+                self.shm.buf[:RING_HEADER_BYTES] = bytes(RING_HEADER_BYTES)
+            except FileExistsError:
+                # left behind by an earlier consumer: keep it, pending records are still valid
+                self.shm = shared_memory.SharedMemory(name=name, create=False)
+        else:
+            # the consumer created it and unlinks it; a producer must not
+            self.shm = attach_untracked(name)
+        if self.shm.size < size:
+            self.shm.close()
+            raise ValueError(f"ring '{name}' is {self.shm.size} bytes, expected {size}")
+        self.buf = self.shm.buf
+        self._head = np.ndarray((1,), dtype=np.uint64, buffer=self.buf)
+        self._tail = np.ndarray((1,), dtype=np.uint64, buffer=self.buf, offset=RING_TAIL_OFFSET)
+        self._closed = np.ndarray((1,), dtype=np.uint32, buffer=self.buf, offset=RING_CLOSED_OFFSET)
+        self._id = np.ndarray((1,), dtype=np.uint64, buffer=self.buf, offset=RING_ID_OFFSET)
+        self._ticks = TickSignal(self.buf)
+        if create:
+            instance_id = int.from_bytes(os.urandom(8), 'little')
+            self._closed[0] = 0
+            self._id[0] = instance_id
+            os.pwrite(self._consumer_fd, instance_id.to_bytes(8, 'little'), 0)
+
+    def close(self, unlink=False):
+        if self._is_consumer:
+            self._closed[0] = 1  # producers stop writing before the segment goes away
+        self.buf = self._head = self._tail = self._closed = self._id = None
+        self._ticks.close()
+        close_shm(self.shm, unlink)
+        # closing a lock file releases the role it held
+        for fd in (self._consumer_fd, self._producer_fd):
+            if fd is not None:
+                os.close(fd)
+        self._consumer_fd = self._producer_fd = None
+
+    # producer side
+
+    def claim_producer(self):
+        """Take the single producer slot; False if another process holds it."""
+        if fcntl is None:
+            return False
+        fd = _lock_file(self.name + ".producer")
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._producer_fd = fd
+        self._consumer_fd = _lock_file(self.name)  # probed by consumer_alive()
+        return True
+
+    def consumer_alive(self):
+        """True while this ring's consumer holds it; meant to be called before every record.
+
+        A closed ring is seen at once from the header. The lock file is probed at most every
+        RING_PROBE_INTERVAL seconds: a consumer that died without closing is noticed within
+        that, as is one restarted on a new ring (the ids then differ).
+        """
+        if self._closed[0]:
+            return False
+        now = time.monotonic()
+        if now - self._probed_at < RING_PROBE_INTERVAL:
+            return True
+        try:
+            fcntl.flock(self._consumer_fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            pass
+        else:
+            fcntl.flock(self._consumer_fd, fcntl.LOCK_UN)
+            return False  # no consumer at all
+        if os.pread(self._consumer_fd, 8, 0) != int(self._id[0]).to_bytes(8, 'little'):
+            return False  # the lock holder is draining some other ring
+        self._probed_at = now
+        return True
+
+    def reserve(self):
+        """Offset into self.buf of the next free record, or None if the ring is full."""
+        head = int(self._head[0])
+        if head - int(self._tail[0]) >= self.slots:
+            return None
+        return RING_HEADER_BYTES + (head & self._mask) * self.record_size
+
+    def publish(self):
+        """Make the record filled in at reserve()'s offset visible and wake the consumer."""
+        self._head += 1
+        self._ticks.notify()
+
+    # consumer side
+
+    def drain(self, handle):
+        """Call handle(buf, offset) for every published record, then free them; return the count."""
+        tail = int(self._tail[0])
+        head = int(self._head[0])
+        for i in range(tail, head):
+            handle(self.buf, RING_HEADER_BYTES + (i & self._mask) * self.record_size)
+        self._tail[0] = head
+        return head - tail
+
+    def wait(self, timeout):
+        """Block until the producer publishes or timeout seconds pass."""
+        seen = self._ticks.current()
+        if int(self._head[0]) == int(self._tail[0]):
+            self._ticks.wait(seen, timeout)
+
 
 class SharedPriceBook:
 
@@ -23,42 +306,27 @@ class SharedPriceBook:
         self.shm_name = meta['shm_name']
         self.symbols = meta['symbols']
         self.n = meta['n']
-        # dtype consistent with orderbook
-        self.dtype = np.dtype([('symbol', 'S12'), ('price', 'f8')])
-        
-        # Attach to shared memory
-        self.shm = shared_memory.SharedMemory(name=self.shm_name, create=False)
         
-        # Set up file lock for safe reads
-        open(LOCK_FILE, 'a').close()
-        self.lock_fd = open(LOCK_FILE, 'r+')
-
-    def update(self, symbol, price):
-        fcntl.flock(self.lock_fd, fcntl.LOCK_EX)
-        try:
-            arr = np.ndarray((self.n,), dtype=self.dtype, buffer=self.shm.buf)
-            sym_b = symbol.upper().encode('utf-8')[:12]
-            for i in range(self.n):
-                if arr['symbol'][i].tobytes().rstrip(b'\x00') == sym_b:
-                    arr['price'][i] = price
-                    fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
-                    return True
-            fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
-        except Exception:
-            fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
-            raise
+        # Attach to shared memory; OrderBook owns the segment and unlinks it
+        self.shm = attach_untracked(self.shm_name)
 
+        # Persistent views over the seqlock counter and the prices, plus a symbol -> slot index
+        self._seq = seq_view(self.shm.buf)
+        self._prices = price_view(self.shm.buf, self.n)
+        self._ticks = TickSignal(self.shm.buf)
+        self._idx = {s.upper(): i for i, s in enumerate(self.symbols)}
 
+    def update(self, symbol, price):
+        # OrderBook is the single writer in normal operation; no lock is taken here
+        i = self._idx.get(symbol.upper())
+        if i is None:
+            return False
+        seqlock_write(self._seq, self._prices, i, price)
+        self._ticks.notify()
+        return True
 
     def read(self, symbol):
-        # Read shared memory under shared lock
-        fcntl.flock(self.lock_fd, fcntl.LOCK_SH)  # shared lock for reads
-        try:
-            arr = np.ndarray((self.n,), dtype=self.dtype, buffer=self.shm.buf)
-            sym_b = symbol.upper().encode('utf-8')[:12]
-            for i in range(self.n):
-                if arr['symbol'][i].tobytes().rstrip(b'\x00') == sym_b:
-                    return float(arr['price'][i])
+        i = self._idx.get(symbol.upper())
+        if i is None:
             return None  # symbol not found
-        finally:
-            fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
\ No newline at end of file
+        return seqlock_read(self._seq, self._prices, i)
@@ -1,42 +1,49 @@
 #!/usr/bin/env python3
 """
 Strategy:
-- Attaches to shared memory (market_meta.json) to read latest prices.
-- Connects to Gateway as a TCP client to receive NEWS messages (sentiment).
-- Maintains a rolling price buffer for a single symbol (or multiple, but we implement one by default).
+- Attaches to shared memory (market_meta.json) to read latest prices, lock-free via the segment's seqlock.
+- Blocks on the segment's tick word (a futex on Linux) until OrderBook publishes new prices, waking
+  at least every poll_interval so news-only changes are still acted on.
+- Connects to Gateway as a TCP client to receive NEWS messages (sentiment), framed by an asyncio
+  StreamReader on a background thread.
+- Maintains a rolling price buffer for a single symbol (or multiple, but we implement one by default),
+  as a fixed NumPy ring with running short/long sums so each update and signal is O(1). A sample is
+  taken each time the symbol's price changes, so the windows count price changes of that symbol.
 - Computes simple moving averages (SMA short and long). Generates price signal:
     short_SMA > long_SMA -> BUY, else SELL (strict > or <).
 - News signal: sentiment > bullish_threshold -> BUY; sentiment < bearish_threshold -> SELL.
 - If both signals agree (both BUY or both SELL) and position differs, send an ORDER to OrderManager over TCP.
-- Orders are serialized as JSON and delimited with MESSAGE_DELIMITER.
+- Orders are sent as fixed-size binary records (order_manager.ORDER_FMT), no delimiter needed.
+  When OrderManager is on this host its shared-memory order ring is used instead of TCP
+  (falling back to TCP if the ring is missing, full, taken by another strategy, or abandoned).
 """
 
 import argparse
+import asyncio
+import functools
 import json
 import time
 import socket
 import threading
-import collections
-import os
+import itertools
 import sys
-from multiprocessing import shared_memory
 import numpy as np
-import fcntl
+from shared_memory_utils import PRICE_DTYPE, price_view, seq_view, seqlock_read, TickSignal, OrderRing, attach_untracked, close_shm
+from order_manager import ORDER_STRUCT, ORDER_SIZE, ORDER_RING_SLOTS, LOCAL_HOSTS, SIDES, order_ring_name
 
 MESSAGE_DELIMITER = b'*'
+NEWS_PREFIX = b'NEWS,'
 META_FILE = "market_meta.json"
-LOCK_FILE = "market.lock"
+NEWS_RCVBUF_BYTES = 65536  # kernel receive buffer for the gateway (NEWS) connection
+NEWS_READ_LIMIT = 65536  # StreamReader buffer limit for the gateway connection
+OM_SNDBUF_BYTES = 65536  # kernel send buffer for the OrderManager connection
 
-def file_lock(fd):
-    class _LockCtx:
-        def __init__(self, fd):
-            self.fd = fd
-        def __enter__(self):
-            fcntl.flock(self.fd, fcntl.LOCK_SH)  # shared lock for reads
-            return self
-        def __exit__(self, exc_type, exc, tb):
-            fcntl.flock(self.fd, fcntl.LOCK_UN)
-    return _LockCtx(fd)
+@functools.lru_cache(maxsize=None)
+def _load_meta():
+    # market_meta.json is written once by OrderBook at startup: parse it once per process,
+    # shared by main() and Strategy.__init__ (a missing file raises and is not cached)
+    with open(META_FILE, 'r') as f:
+        return json.load(f)
 
 class Strategy:
     def __init__(self,
@@ -48,7 +55,8 @@ class Strategy:
                  gateway_host='127.0.0.1',
                  gateway_port=9999,
                  order_manager_host='127.0.0.1',
-                 order_manager_port=10000):
+                 order_manager_port=10000,
+                 use_order_ring=True):
         self.symbol = symbol.upper()
         self.short_w = short_w
         self.long_w = long_w
@@ -59,28 +67,47 @@ class Strategy:
         self.order_manager_host = order_manager_host
         self.order_manager_port = order_manager_port
 
-        # rolling buffer for prices (deque)
-        self.buf = collections.deque(maxlen=self.long_w)
+        # rolling buffer for prices: ring of the last long_w prices plus running sums
+        # over the long and short windows, updated incrementally on every push
+        self._ring = np.empty(self.long_w, dtype=np.float64)
+        self._head = 0  # next slot to write
+        self._count = 0
+        self._long_sum = 0.0
+        self._short_sum = 0.0
         self.position = None  # None, 'long', 'short'
         self.latest_sentiment = None
         self.stop = False
+        self._client_order_id = itertools.count(1)
+        # persistent connection to OrderManager, opened on first order and reused
+        self._om_sock = None
+        # shared-memory order ring, when OrderManager runs on this host; attached lazily so a
+        # ring created (or re-created) after startup is still picked up
+        self._use_order_ring = use_order_ring and order_manager_host in LOCAL_HOSTS
+        self._order_ring = None
+        self._order_ring_busy_reported = False
+        self._ensure_order_ring()
 
         # attach to shared memory using metadata
-        if not os.path.exists(META_FILE):
+        # (already parsed by main() when run as a script)
+        try:
+            meta = _load_meta()
+        except FileNotFoundError:
             print(f"[Strategy] Meta file {META_FILE} not found. Make sure OrderBook created it.")
             sys.exit(1)
-        with open(META_FILE, 'r') as f:
-            meta = json.load(f)
         self.shm_name = meta['shm_name']
         self.symbols = meta['symbols']
         self.n = meta['n']
         # dtype consistent with orderbook
-        self.dtype = np.dtype([('symbol', 'S12'), ('price', 'f8')])
+        self.dtype = PRICE_DTYPE
 
-        # attach
-        self.shm = shared_memory.SharedMemory(name=self.shm_name, create=False)
-        open(LOCK_FILE, 'a').close()
-        self.lock_fd = open(LOCK_FILE, 'r+')
+        # attach; OrderBook owns the segment, so exiting here must not unlink it
+        self.shm = attach_untracked(self.shm_name)
+        # persistent views over the seqlock counter and the prices
+        self._seq = seq_view(self.shm.buf)
+        self._prices = price_view(self.shm.buf, self.n)
+        self._ticks = TickSignal(self.shm.buf)
+        # slot of self.symbol, resolved once (slot order is the symbol order in the meta file)
+        self._idx = self.symbols.index(self.symbol) if self.symbol in self.symbols else None
 
         # Launch thread to listen to Gateway (for NEWS)
         self.news_thread = threading.Thread(target=self._listen_gateway_news, daemon=True)
@@ -88,75 +115,111 @@ class Strategy:
 
     def close(self):
         self.stop = True
-        try:
-            self.shm.close()
-        except Exception:
-            pass
+        self._seq = self._prices = None
+        self._ticks.close()
+        close_shm(self.shm)
+        self._close_om_connection()
+        if self._order_ring is not None:
+            self._order_ring.close()
+            self._order_ring = None
+
+    def _ensure_order_ring(self):
+        """The order ring if OrderManager is draining it, else None (the order goes over TCP)."""
+        ring = self._order_ring
+        if ring is not None and not ring.consumer_alive():
+            # OrderManager is gone, however it exited, or was restarted on a new ring: nothing
+            # drains this one any more, so drop it and look for the current ring below
+            ring.close()
+            ring = self._order_ring = None
+        if ring is None:
+            if not self._use_order_ring:
+                return None
+            try:
+                ring = OrderRing(order_ring_name(self.order_manager_port), ORDER_SIZE, ORDER_RING_SLOTS)
+            except (FileNotFoundError, ValueError):
+                return None  # no ring (yet), or an incompatible one
+            if not ring.claim_producer():
+                ring.close()
+                if not self._order_ring_busy_reported:
+                    print("[Strategy] Order ring in use by another strategy; sending orders over TCP")
+                    self._order_ring_busy_reported = True
+                return None
+            if not ring.consumer_alive():
+                ring.close()  # left behind by an OrderManager that is no longer running
+                return None
+            self._order_ring = ring
+            print(f"[Strategy] Sending orders through shared-memory ring '{ring.name}'")
+        return ring
 
     def _get_latest_price(self):
-        # read shared memory under shared lock
-        with file_lock(self.lock_fd):
-            arr = np.ndarray((self.n,), dtype=self.dtype, buffer=self.shm.buf)
-            sym_b = self.symbol.encode('utf-8')[:12]
-            for i in range(self.n):
-                if arr['symbol'][i].tobytes().rstrip(b'\x00') == sym_b:
-                    return float(arr['price'][i])
-        return None
+        # seqlock read: retries on a concurrent write instead of taking a lock, no syscalls
+        if self._idx is None:
+            return None  # symbol not in shared memory
+        return seqlock_read(self._seq, self._prices, self._idx)
 
     def _listen_gateway_news(self):
         """Connect to Gateway and keep latest sentiment. We only care about NEWS messages."""
+        # the price loop blocks on the tick futex, so NEWS runs its own event loop in this thread
+        asyncio.run(self._news_loop())
+
+    async def _news_loop(self):
+        loop = asyncio.get_running_loop()
         while not self.stop:
+            sock = writer = None
             try:
                 sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                sock.connect((self.gateway_host, self.gateway_port))
-                sock.settimeout(5.0)
-                buffer = b''
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, NEWS_RCVBUF_BYTES)
+                sock.setblocking(False)
+                await loop.sock_connect(sock, (self.gateway_host, self.gateway_port))
+                # NEWS must not sit behind Nagle; keepalive replaces the old 5s recv timeout
+                # for noticing a dead gateway, so reads can simply wait until data arrives
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                reader, writer = await asyncio.open_connection(sock=sock, limit=NEWS_READ_LIMIT)
                 while not self.stop:
-                    try:
-                        data = sock.recv(4096)
-                        if not data:
-                            raise ConnectionError("gateway closed")
-                        buffer += data
-                        while True:
-                            idx = buffer.find(MESSAGE_DELIMITER)
-                            if idx == -1:
-                                break
-                            chunk = buffer[:idx]
-                            buffer = buffer[idx+1:]
-                            if not chunk:
-                                continue
-                            try:
-                                txt = chunk.decode('utf-8')
-                            except Exception:
-                                continue
-                            parts = txt.split(',', 1)
-                            if len(parts) != 2:
-                                continue
-                            key = parts[0].strip().upper()
-                            val = parts[1].strip()
-                            if key == "NEWS":
-                                try:
-                                    sent = int(val)
-                                    self.latest_sentiment = sent
-                                    # debug
-                                    # print(f"[Strategy] NEWS sentiment {sent}")
-                                except ValueError:
-                                    pass
-                            # ignore price messages (we read prices from shared memory)
-                    except socket.timeout:
-                        continue
+                    # StreamReader does the buffering and delimiter scan; we get one whole message
+                    frame = await reader.readuntil(MESSAGE_DELIMITER)
+                    if frame.startswith(NEWS_PREFIX):
+                        try:
+                            self.latest_sentiment = int(frame[len(NEWS_PREFIX):-1])
+                            # debug
+                            # print(f"[Strategy] NEWS sentiment {self.latest_sentiment}")
+                        except ValueError:
+                            pass
+                    # ignore price messages (we read prices from shared memory)
             except Exception as e:
+                if writer is not None:
+                    writer.close()
+                elif sock is not None:
+                    sock.close()
                 print("[Strategy] Gateway connection fail:", e)
-                time.sleep(2.0)
+                await asyncio.sleep(2.0)
                 continue
 
+    def _push_price(self, price):
+        ring, head = self._ring, self._head
+        if self._count == self.long_w:
+            # evict the oldest price, which lives in the slot about to be overwritten
+            self._long_sum -= float(ring[head])
+        if self._count >= self.short_w:
+            # the price short_w pushes back leaves the short window
+            self._short_sum -= float(ring[(head - self.short_w) % self.long_w])
+        ring[head] = price
+        self._long_sum += price
+        self._short_sum += price
+        self._head = (head + 1) % self.long_w
+        if self._count < self.long_w:
+            self._count += 1
+        if self._head == 0 and self._count == self.long_w:
+            # once per lap, recompute the sums exactly so rounding error cannot build up
+            self._long_sum = float(ring.sum())
+            self._short_sum = float(ring[self.long_w - self.short_w:].sum())
+
     def _compute_price_signal(self):
-        if len(self.buf) < self.long_w:
+        if self._count < self.long_w:
             return None  # insufficient history
-        prices = list(self.buf)
-        short_sma = sum(prices[-self.short_w:]) / self.short_w
-        long_sma = sum(prices) / self.long_w
-        if short_sma > long_sma:
+        # short_sum/short_w > long_sum/long_w, without the divisions
+        if self._short_sum * self.long_w > self._long_sum * self.short_w:
             return "BUY"
         else:
             return "SELL"
@@ -170,38 +233,66 @@ class Strategy:
             return "SELL"
         return None
 
-    def _send_order(self, side, price, size=100):
-        order = {
-            "type": "ORDER",
-            "side": side,
-            "symbol": self.symbol,
-            "size": size,
-            "price": price,
-            "timestamp": time.time()
-        }
-        try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.connect((self.order_manager_host, self.order_manager_port))
-            payload = json.dumps(order).encode('utf-8') + MESSAGE_DELIMITER
-            s.sendall(payload)
-            # optional receive ack
+    def _ensure_om_connection(self):
+        if self._om_sock is None:
+            s = socket.create_connection((self.order_manager_host, self.order_manager_port))
+            s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            # room for a burst of records if OrderManager falls behind, so sendall does not block
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, OM_SNDBUF_BYTES)
+            self._om_sock = s
+        return self._om_sock
+
+    def _close_om_connection(self):
+        if self._om_sock is not None:
             try:
-                data = s.recv(4096)
-                if data:
-                    print("[Strategy] OrderManager replied:", data.decode('utf-8').strip('*'))
+                self._om_sock.close()
             except Exception:
                 pass
-            s.close()
+            self._om_sock = None
+
+    def _send_order(self, side, price, size=100):
+        try:
+            fields = (SIDES.index(side), 0, self.symbol.encode('utf-8')[:12],
+                      price, size, next(self._client_order_id), time.time())
+            ring = self._ensure_order_ring()
+            if ring is not None:
+                offset = ring.reserve()
+                if offset is not None:
+                    # packed straight into the shared slot, then published
+                    ORDER_STRUCT.pack_into(ring.buf, offset, *fields)
+                    ring.publish()
+                    print(f"[Strategy] Sent order {side} {self.symbol} @ {price}")
+                    return
+                # ring full: this order goes over TCP
+            payload = ORDER_STRUCT.pack(*fields)
+            try:
+                self._ensure_om_connection().sendall(payload)
+            except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError):
+                # OrderManager went away since the last order: reconnect once and resend
+                self._close_om_connection()
+                self._ensure_om_connection().sendall(payload)
             print(f"[Strategy] Sent order {side} {self.symbol} @ {price}")
         except Exception as e:
+            self._close_om_connection()
             print("[Strategy] Failed to send order:", e)
 
     def run(self, poll_interval=0.5):
+        last_tick = None
+        last_pushed = None
         try:
             while True:
-                price = self._get_latest_price()
-                if price is not None:
-                    self.buf.append(price)
+                tick = self._ticks.current()
+                if tick != last_tick:
+                    # OrderBook published new prices (always true on the first pass)
+                    last_tick = tick
+                    price = self._get_latest_price()
+                    # the tick word moves for every receive batch, including ones that only
+                    # touched other symbols or repeated this price in a snapshot: sample only
+                    # when this symbol's price actually changed
+                    if price is not None and price != last_pushed:
+                        self._push_price(price)
+                        last_pushed = price
                 # compute signals only if enough history
                 price_sig = self._compute_price_signal()
                 news_sig = self._compute_news_signal()
@@ -219,7 +310,8 @@ class Strategy:
                     else:
                         pass  # already in same position
                 # else do nothing
-                time.sleep(poll_interval)
+                # sleep until the next tick; the timeout re-checks news between ticks
+                self._ticks.wait(last_tick, poll_interval)
         except KeyboardInterrupt:
             print("\n[Strategy] exiting (KeyboardInterrupt)")
         finally:
@@ -236,16 +328,16 @@ def parse_args():
     p.add_argument("--gateway-port", type=int, default=9999)
     p.add_argument("--order-manager-host", default="127.0.0.1")
     p.add_argument("--order-manager-port", type=int, default=10000)
+    p.add_argument("--no-order-ring", action="store_true", help="Always send orders over TCP")
     return p.parse_args()
 
-if __name__ == "__main__":
+def main():
     args = parse_args()
-    if not os.path.exists(META_FILE):
+    try:
+        default_symbol = _load_meta()['symbols'][0]
+    except FileNotFoundError:
         print(f"[Strategy] {META_FILE} not found. Start OrderBook first.")
         sys.exit(1)
-    with open(META_FILE, 'r') as f:
-        meta = json.load(f)
-    default_symbol = meta['symbols'][0]
     symbol = args.symbol.upper() if args.symbol else default_symbol
     strat = Strategy(symbol,
                      short_w=args.short,
@@ -255,25 +347,9 @@ if __name__ == "__main__":
                      gateway_host=args.gateway_host,
                      gateway_port=args.gateway_port,
                      order_manager_host=args.order_manager_host,
-                     order_manager_port=args.order_manager_port)
+                     order_manager_port=args.order_manager_port,
+                     use_order_ring=not args.no_order_ring)
     strat.run()
 
-def main():
-    args = parse_args()
-    if not os.path.exists(META_FILE):
-        print(f"[Strategy] {META_FILE} not found. Start OrderBook first.")
-        sys.exit(1)
-    with open(META_FILE, 'r') as f:
-        meta = json.load(f)
-    default_symbol = meta['symbols'][0]
-    symbol = args.symbol.upper() if args.symbol else default_symbol
-    strat = Strategy(symbol,
-                     short_w=args.short,
-                     long_w=args.long,
-                     bullish_threshold=args.bullish,
-                     bearish_threshold=args.bearish,
-                     gateway_host=args.gateway_host,
-                     gateway_port=args.gateway_port,
-                     order_manager_host=args.order_manager_host,
-                     order_manager_port=args.order_manager_port)
-    strat.run()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -4,20 +4,22 @@ import socket
 HOST = "127.0.0.1"
 PORT = 9999
 DELIM = b'*'
-BUFFER_SIZE = 4096
+BUFFER_SIZE = 65536
 
 def run_client():
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     s.connect((HOST, PORT))
     print("Connected to Gateway.")
     buffer = b''
+    # reused for every recv_into instead of allocating a new bytes object per recv
+    rx = memoryview(bytearray(BUFFER_SIZE))
     try:
         while True:
-            data = s.recv(BUFFER_SIZE)
-            if not data:
+            n = s.recv_into(rx)
+            if not n:
                 print("Connection closed by server.")
                 break
-            buffer += data
+            buffer += rx[:n]
             # split by delimiter
             while True:
                 idx = buffer.find(DELIM)
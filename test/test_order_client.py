@@ -1,15 +1,12 @@
-import socket, json
+import os, socket, sys, time
 
-MESSAGE_DELIMITER = b'*'
+# order_manager lives in the repository root, one level up from this script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from order_manager import ORDER_STRUCT
 
-order = {
-    "symbol": "AAPL",
-    "side": "BUY",
-    "qty": 10,
-    "price": 173.20
-}
+# side (0=BUY, 1=SELL), pad, symbol, price, qty, client order id, send timestamp
+order = ORDER_STRUCT.pack(0, 0, b"AAPL", 173.20, 10, 1, time.time())
 
 with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-    s.connect(("127.0.0.1", 9999))
-    msg = json.dumps(order).encode('utf-8') + MESSAGE_DELIMITER
-    s.sendall(msg)
\ No newline at end of file
+    s.connect(("127.0.0.1", 10000))
+    s.sendall(order)